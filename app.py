@@ -5,18 +5,25 @@
 import streamlit as st
 import requests
 import json
-import pandas as pd
 from datetime import datetime
 import hashlib
-import time
+import hmac
+import html
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- 1. Global Configuration and Secrets Loading ---
-try:
+@st.cache_resource
+def load_firebase_config():
+    """Parses FIREBASE_CONFIG from the secrets once per process instead of on every rerun."""
     firebase_config_str = st.secrets["FIREBASE_CONFIG"]
     if isinstance(firebase_config_str, str):
         # Fix escaped newlines and clean up string format
         firebase_config_str = firebase_config_str.replace('\\\\n', '\\n').strip().strip('"').strip("'")
-    firebaseConfig = json.loads(firebase_config_str)
+    return json.loads(firebase_config_str)
+
+try:
+    firebaseConfig = load_firebase_config()
 except Exception as e:
     st.error(f"Failed to parse FIREBASE_CONFIG: {e}")
     st.stop()
@@ -27,28 +34,16 @@ if not GEMINI_API_KEY:
     st.stop()
 
 # --- 2. Firebase Initialization ---
+# The leading underscore tells Streamlit not to hash the (large) service-account dict on every rerun
 @st.cache_resource
-def initialize_firebase(config):
+def initialize_firebase(_config):
     """Initializes and returns the Firebase firestore client."""
     import firebase_admin
     from firebase_admin import credentials, firestore
     try:
-        # Create service account credentials dictionary
-        service_account_info = {
-            "type": config["type"],
-            "project_id": config["project_id"],
-            "private_key_id": config["private_key_id"],
-            "private_key": config["private_key"],
-            "client_email": config["client_email"],
-            "client_id": config["client_id"],
-            "auth_uri": config["auth_uri"],
-            "token_uri": config["token_uri"],
-            "auth_provider_x509_cert_url": config["auth_provider_x509_cert_url"],
-            "client_x509_cert_url": config["client_x509_cert_url"],
-            "universe_domain": config["universe_domain"],
-        }
+        # FIREBASE_CONFIG is the service-account JSON itself; Certificate only reads the fields it needs
         if not firebase_admin._apps:
-            cred = credentials.Certificate(service_account_info)
+            cred = credentials.Certificate(_config)
             firebase_admin.initialize_app(cred)
         return firestore.client()
     except Exception as e:
@@ -56,6 +51,7 @@ def initialize_firebase(config):
         st.stop()
 
 db = initialize_firebase(firebaseConfig)
+APP_ID = firebaseConfig["project_id"]
 
 # --- 3. Authentication & State Management ---
 # Initialize all necessary session states
@@ -76,25 +72,67 @@ if 'current_tab' not in st.session_state:
     st.session_state.current_tab = "💬 AI Mentor"
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'gemini_contents' not in st.session_state:
+    # chat_history converted to the Gemini request format, kept in lockstep with it
+    st.session_state.gemini_contents = []
 if 'journal_entries' not in st.session_state:
     st.session_state.journal_entries = []
+if 'journal_has_more' not in st.session_state:
+    # Whether older journal entries than the loaded pages may exist in Firestore
+    st.session_state.journal_has_more = False
+if 'journal_visible' not in st.session_state:
+    # How many of the loaded journal entries the history renders (set in display_journal_tab)
+    st.session_state.journal_visible = 0
 if 'goals' not in st.session_state:
     st.session_state.goals = []
 if 'mentor_persona' not in st.session_state:
     st.session_state.mentor_persona = "Default"
 if 'confirm_delete' not in st.session_state:
     st.session_state.confirm_delete = False
+if 'export_data' not in st.session_state:
+    # Bytes of the prepared export file, None until "Prepare Download" is clicked
+    st.session_state.export_data = None
+if 'pending_writes' not in st.session_state:
+    # (future, collection, error message) for Firestore writes still running in the background
+    st.session_state.pending_writes = []
+if 'write_errors' not in st.session_state:
+    # Messages of failed background writes, shown on the next full rerun
+    st.session_state.write_errors = []
     
 # NOTE: Removed 'generated_prompt' from session state
 
+@st.cache_resource
+def get_password_hasher():
+    """Returns the shared Argon2id password hasher (OWASP-recommended parameters)."""
+    from argon2 import PasswordHasher
+    return PasswordHasher(time_cost=3, memory_cost=65536, parallelism=2, hash_len=32, salt_len=16)
+
 def hash_password(password):
-    """Simple password hashing simulation using SHA-256."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hashes a password with Argon2id; the random salt is embedded in the returned PHC string."""
+    return get_password_hasher().hash(password)
+
+def verify_password(stored_hash, password):
+    """Checks a password against its stored hash. Returns (is_valid, needs_rehash)."""
+    if not stored_hash:
+        return False, False
+    if not stored_hash.startswith("$argon2"):
+        # Legacy unsalted SHA-256 hash: compare in constant time and ask for a migration on success
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(stored_hash, legacy_hash), True
+    from argon2.exceptions import InvalidHashError, VerificationError
+    hasher = get_password_hasher()
+    try:
+        hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False, False
+    return True, hasher.check_needs_rehash(stored_hash)
 
+# PERFORMANCE OPTIMIZATION: Collection references are built once per process (st.cache_resource)
+# instead of re-walking the artifacts/{app_id}/... path on every load, save and delete.
+@st.cache_resource(show_spinner=False)
 def get_users_collection_ref():
     """Returns the Firestore reference for the global users collection."""
-    app_id = firebaseConfig["project_id"]
-    return db.collection('artifacts').document(app_id).collection('public').document('data').collection('users')
+    return db.collection('artifacts').document(APP_ID).collection('public').document('data').collection('users')
 
 def login_user(email, password):
     """Attempts to log in a user by checking credentials against Firestore."""
@@ -103,7 +141,11 @@ def login_user(email, password):
         user_doc = user_doc_ref.get()
         if user_doc.exists:
             user_data = user_doc.to_dict()
-            if user_data.get('password_hash') == hash_password(password):
+            is_valid, needs_rehash = verify_password(user_data.get('password_hash'), password)
+            if is_valid:
+                if needs_rehash:
+                    # Transparently upgrade legacy SHA-256 (or outdated Argon2) hashes
+                    user_doc_ref.update({"password_hash": hash_password(password)})
                 st.session_state.logged_in = True
                 st.session_state.current_user_email = email.lower()
                 
@@ -158,50 +200,158 @@ def logout():
     st.session_state.current_tab = "💬 AI Mentor"
     # Clear data structures
     st.session_state.chat_history = []
+    st.session_state.gemini_contents = []
     st.session_state.journal_entries = []
+    st.session_state.journal_has_more = False
+    st.session_state.journal_visible = 0
     st.session_state.goals = []
     st.session_state.mentor_persona = "Default"
     st.session_state.confirm_delete = False
+    st.session_state.pending_writes = []
+    st.session_state.write_errors = []
+    st.session_state.export_data = None
     # NOTE: Removed clearing 'generated_prompt'
     st.info("You have been logged out.")
     st.rerun()
 
 # --- 4. Firestore Data Persistence (Refactored for Performance) ---
+@st.cache_resource(show_spinner=False)
+def get_user_doc_ref(user_id):
+    """Returns the private document ref that holds a user's collections."""
+    return db.collection('artifacts').document(APP_ID).collection('users').document(user_id)
+
+@st.cache_resource(show_spinner=False)
 def get_user_chat_collection_ref(user_id):
     """Returns the private collection ref for chat history."""
-    app_id = firebaseConfig["project_id"]
-    return db.collection('artifacts').document(app_id).collection('users').document(user_id).collection('chat_history')
+    return get_user_doc_ref(user_id).collection('chat_history')
 
+@st.cache_resource(show_spinner=False)
 def get_user_journal_collection_ref(user_id):
     """Returns the private collection ref for journal entries."""
-    app_id = firebaseConfig["project_id"]
-    return db.collection('artifacts').document(app_id).collection('users').document(user_id).collection('journal_entries')
+    return get_user_doc_ref(user_id).collection('journal_entries')
 
+@st.cache_resource(show_spinner=False)
 def get_user_goal_collection_ref(user_id):
     """Returns the private collection ref for goals."""
-    app_id = firebaseConfig["project_id"]
-    return db.collection('artifacts').document(app_id).collection('users').document(user_id).collection('goals')
+    return get_user_doc_ref(user_id).collection('goals')
+
+@st.cache_resource
+def get_data_revisions():
+    """Returns the process-wide map of (user_id, collection) -> write counter."""
+    return {}
+
+def get_data_revision(user_id, collection):
+    """Returns the current write counter used to key the cached reads of a collection."""
+    return get_data_revisions().get((user_id, collection), 0)
+
+def bump_data_revision(user_id, collection):
+    """Invalidates the cached reads of a collection after a write."""
+    revisions = get_data_revisions()
+    revisions[(user_id, collection)] = revisions.get((user_id, collection), 0) + 1
+
+# Upper bounds on how much history is read per load
+CHAT_HISTORY_LIMIT = 200  # most recent chat messages
+JOURNAL_LOAD_LIMIT = 50  # journal entries per page ("Load older entries" fetches the next page)
+# Cached reads also expire after this many seconds, to pick up changes made by other server processes
+FIRESTORE_CACHE_TTL = 600
+
+# Mood mapping for chart scoring (higher is generally better); the score is stored with each entry
+MOOD_SCORES = {"Happy": 5, "Excited": 4, "Calm": 3, "Anxious": 2, "Stressed": 1, "Sad": 0}
+DEFAULT_MOOD_SCORE = 3  # "Calm", used for missing or unknown moods
+
+# PERFORMANCE OPTIMIZATION: Firestore reads are cached per user and revision, so they
+# are only repeated after a write (or a new session for the same user) actually changed the data.
+@st.cache_data(show_spinner=False, ttl=FIRESTORE_CACHE_TTL)
+def fetch_chat_history(user_id, revision):
+    """Reads the chat history from Firestore (cached per revision)."""
+    chat_ref = get_user_chat_collection_ref(user_id)
+    # Firestore returns the documents already ordered, no client-side sort needed;
+    # limit_to_last keeps the newest messages (still in chronological order)
+    chat_docs = chat_ref.order_by('timestamp').limit_to_last(CHAT_HISTORY_LIMIT).get()
+    return [doc.to_dict() for doc in chat_docs]
+
+@st.cache_data(show_spinner=False, ttl=FIRESTORE_CACHE_TTL)
+def fetch_journal_entries(user_id, revision, before=None):
+    """Reads a page of journal entries from Firestore, newest first (cached per revision).
+
+    With `before` set, the page starts after the entry with that timestamp (the oldest one shown so far).
+    """
+    query = get_user_journal_collection_ref(user_id).order_by('timestamp', direction='DESCENDING')
+    if before is not None:
+        query = query.start_after({'timestamp': before})
+    journal_docs = query.limit(JOURNAL_LOAD_LIMIT).get()
+    entries = [dict(doc.to_dict(), id=doc.id) for doc in journal_docs]
+    # Entries written before mood scores were stored get theirs derived once here
+    for entry in entries:
+        if 'mood_score' not in entry:
+            entry['mood_score'] = MOOD_SCORES.get(entry.get('mood'), DEFAULT_MOOD_SCORE)
+    return entries
+
+@st.cache_data(show_spinner=False, ttl=FIRESTORE_CACHE_TTL)
+def fetch_goals(user_id, revision):
+    """Reads the goals from Firestore, newest first (cached per revision)."""
+    goal_ref = get_user_goal_collection_ref(user_id)
+    goal_docs = goal_ref.order_by('timestamp', direction='DESCENDING').get()
+    return [dict(doc.to_dict(), id=doc.id) for doc in goal_docs]
+
+def fetch_export_data(user_id):
+    """Reads the complete chat, journal and goal collections for the data export (uncached).
+
+    The session lists only hold the bounded reads (recent chat, loaded journal pages), which must
+    not be passed off as a full export. The three reads run concurrently.
+    """
+    queries = {
+        'journal_entries': get_user_journal_collection_ref(user_id).order_by('timestamp', direction='DESCENDING'),
+        'chat_history': get_user_chat_collection_ref(user_id).order_by('timestamp'),
+        'goals': get_user_goal_collection_ref(user_id).order_by('timestamp', direction='DESCENDING'),
+    }
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = {name: executor.submit(query.get) for name, query in queries.items()}
+    return {name: [doc.to_dict() for doc in future.result()] for name, future in futures.items()}
+
+COLLECTION_FETCHERS = {
+    'chat_history': fetch_chat_history,
+    'journal_entries': fetch_journal_entries,
+    'goals': fetch_goals,
+}
+
+# Session state flag telling whether each collection (same name in session state) has been loaded
+LOADED_FLAGS = {
+    'chat_history': 'chat_loaded',
+    'journal_entries': 'journal_loaded',
+    'goals': 'goals_loaded',
+}
+
+def load_user_data(user_id, collections):
+    """Loads several collections concurrently and returns them keyed by collection name."""
+    # PERFORMANCE OPTIMIZATION: Independent reads overlap, so the wait is the slowest read, not the sum.
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=len(collections), initializer=add_script_run_ctx, initargs=(None, ctx)) as executor:
+        futures = {
+            name: executor.submit(COLLECTION_FETCHERS[name], user_id, get_data_revision(user_id, name))
+            for name in collections
+        }
+    data = {}
+    for name, future in futures.items():
+        try:
+            data[name] = future.result()
+        except Exception as e:
+            st.error(f"Error loading {name.replace('_', ' ')}: {e}")
+            data[name] = []
+    return data
 
 def load_chat_history(user_id):
     """Loads chat history only."""
     try:
-        chat_ref = get_user_chat_collection_ref(user_id)
-        chat_docs = chat_ref.stream()
-        chat_data = [doc.to_dict() for doc in chat_docs]
-        chat_data.sort(key=lambda x: x.get('timestamp', 0))
-        return chat_data
+        return fetch_chat_history(user_id, get_data_revision(user_id, 'chat_history'))
     except Exception as e:
         st.error(f"Error loading chat history: {e}")
         return []
 
-def load_journal_entries(user_id):
-    """Loads journal entries only."""
+def load_journal_entries(user_id, before=None):
+    """Loads a page of journal entries only."""
     try:
-        journal_ref = get_user_journal_collection_ref(user_id)
-        journal_docs = journal_ref.stream()
-        journal_data = [doc.to_dict() for doc in journal_docs]
-        journal_data.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-        return journal_data
+        return fetch_journal_entries(user_id, get_data_revision(user_id, 'journal_entries'), before)
     except Exception as e:
         st.error(f"Error loading journal entries: {e}")
         return []
@@ -209,213 +359,438 @@ def load_journal_entries(user_id):
 def load_goals(user_id):
     """Loads goals only."""
     try:
-        goal_ref = get_user_goal_collection_ref(user_id)
-        goal_docs = goal_ref.stream()
-        goal_data = [dict(doc.to_dict(), id=doc.id) for doc in goal_docs]
-        goal_data.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-        return goal_data
+        return fetch_goals(user_id, get_data_revision(user_id, 'goals'))
     except Exception as e:
         st.error(f"Error loading goals: {e}")
         return []
 
-def save_chat_message(role, content):
-    """Saves a chat message and updates session state."""
-    timestamp = datetime.now().timestamp()
-    message = {
+def new_chat_message(role, content):
+    """Builds a chat message stamped with the current time."""
+    return {
         "role": role,
         "content": content,
-        "timestamp": timestamp,
+        "timestamp": datetime.now().timestamp(),
     }
-    try:
-        chat_ref = get_user_chat_collection_ref(st.session_state.current_user_email)
-        chat_ref.add(message)
-        st.session_state.chat_history.append(message)
-    except Exception as e:
-        st.error(f"Failed to save message: {e}")
+
+def to_gemini_content(message):
+    """Converts a stored chat message to the Gemini 'contents' format."""
+    return {"role": "user" if message["role"] == "user" else "model", "parts": [{"text": message["content"]}]}
+
+# PERFORMANCE OPTIMIZATION: Writes run on a shared worker pool, so the UI updates from the local
+# copy right away instead of waiting for the Firestore round trip.
+@st.cache_resource
+def get_write_pool():
+    """Returns the process-wide worker pool for background Firestore writes."""
+    return ThreadPoolExecutor(max_workers=4)
+
+def submit_write(user_id, collection, write, error_message):
+    """Runs a Firestore write in the background and invalidates the collection's cached data.
+
+    Callers patch session state right after submitting, so the revision is bumped here on the
+    script thread: caches keyed on it (mood chart) see the change on the next run of the code
+    that uses them, whether or not the write has finished. It is bumped again once the write has
+    landed, so a Firestore read cached while the write was still in flight is not reused.
+    A prepared export no longer matches the data and is dropped; see rerun_if_export_dropped.
+    """
+    bump_data_revision(user_id, collection)
+    st.session_state.export_data = None
+    def run():
+        write()
+        bump_data_revision(user_id, collection)
+    future = get_write_pool().submit(run)
+    st.session_state.pending_writes.append((future, collection, error_message))
+
+def collect_failed_writes():
+    """Drops finished background writes from the pending list; returns True if any of them failed.
+
+    Failures are queued in session state for report_write_errors, and the affected collection is
+    marked for reload (the local copy holds an item that was never stored).
+    """
+    still_pending = []
+    failed = False
+    for future, collection, error_message in st.session_state.pending_writes:
+        if not future.done():
+            still_pending.append((future, collection, error_message))
+        elif future.exception():
+            st.session_state.write_errors.append(f"{error_message}: {future.exception()}")
+            st.session_state[LOADED_FLAGS[collection]] = False
+            failed = True
+    st.session_state.pending_writes = still_pending
+    return failed
+
+def report_write_errors():
+    """Shows errors of background writes that finished since the last rerun."""
+    collect_failed_writes()
+    for message in st.session_state.write_errors:
+        st.error(message)
+    st.session_state.write_errors = []
+
+def rerun_if_export_dropped(export_was_prepared):
+    """Reruns the full app when a write from inside a fragment dropped a prepared export.
+
+    Fragment reruns do not redraw the sidebar, which would keep offering the outdated download.
+    """
+    if export_was_prepared and st.session_state.export_data is None:
+        st.rerun()
+
+def save_chat_messages(messages):
+    """Saves chat messages in one background batched write and appends them to session state."""
+    chat_ref = get_user_chat_collection_ref(st.session_state.current_user_email)
+    # A chat turn (user prompt + AI reply) is committed in a single round trip
+    batch = db.batch()
+    for message in messages:
+        batch.set(chat_ref.document(), message)
+    submit_write(st.session_state.current_user_email, 'chat_history', batch.commit, "Failed to save message")
+    st.session_state.chat_history.extend(messages)
+    st.session_state.gemini_contents.extend(to_gemini_content(message) for message in messages)
+    # Keep the in-memory history bounded like the initial load; older turns stay in Firestore.
+    # Session state lives as long as the browser session, so an unbounded list would only grow.
+    del st.session_state.chat_history[:-CHAT_HISTORY_LIMIT]
+    del st.session_state.gemini_contents[:-CHAT_HISTORY_LIMIT]
 
 def save_journal_entry(date, title, content, mood):
-    """Saves a journal entry and reloads journal data (only journal data)."""
+    """Saves a journal entry in the background and adds it to the local journal list (no reload)."""
     entry = {
         "date": date,
         "title": title,
         "content": content,
         "mood": mood,
+        "mood_score": MOOD_SCORES.get(mood, DEFAULT_MOOD_SCORE),
         "timestamp": datetime.now().timestamp()
     }
-    try:
-        journal_ref = get_user_journal_collection_ref(st.session_state.current_user_email)
-        journal_ref.add(entry)
-        # Reload journal data to update display immediately
-        st.session_state.journal_entries = load_journal_entries(st.session_state.current_user_email)
-        st.success("Journal entry saved!")
-    except Exception as e:
-        st.error(f"Failed to save journal entry: {e}")
+    # The document id is generated client-side, so the local entry has it before the write lands
+    doc_ref = get_user_journal_collection_ref(st.session_state.current_user_email).document()
+    submit_write(st.session_state.current_user_email, 'journal_entries', lambda: doc_ref.set(entry), "Failed to save journal entry")
+    # Entries are newest first and this one has the latest timestamp, so it goes on top;
+    # no need to re-read the whole collection to update the display
+    st.session_state.journal_entries.insert(0, dict(entry, id=doc_ref.id))
+    st.success("Journal entry saved!")
 
 def save_goal(user_id, goal_text, deadline):
-    """Saves a goal and reloads goal data (only goal data)."""
-    try:
-        goal_ref = get_user_goal_collection_ref(user_id)
-        goal_ref.add({
-            "text": goal_text,
-            "deadline": deadline.strftime('%Y-%m-%d') if deadline else None,
-            "completed": False,
-            "timestamp": datetime.now().timestamp()
-        })
-        # Reload goal data to update display immediately
-        st.session_state.goals = load_goals(user_id)
-        st.session_state.goals_loaded = True
-        st.success("Goal saved!")
-    except Exception as e:
-        st.error(f"Error saving goal: {e}")
+    """Saves a goal in the background and adds it to the local goal list (no reload)."""
+    goal = {
+        "text": goal_text,
+        "deadline": deadline.strftime('%Y-%m-%d') if deadline else None,
+        "completed": False,
+        "timestamp": datetime.now().timestamp()
+    }
+    doc_ref = get_user_goal_collection_ref(user_id).document()
+    submit_write(user_id, 'goals', lambda: doc_ref.set(goal), "Error saving goal")
+    # Goals are newest first, so the new one goes on top
+    st.session_state.goals.insert(0, dict(goal, id=doc_ref.id))
+    st.success("Goal saved!")
 
-def update_goal_status(user_id, goal_id, completed):
-    """Updates the status of a specific goal and reloads goal data (only goal data)."""
+def update_goals_status(user_id, goal_ids, completed):
+    """Updates the status of several goals in one background batched write and patches the local goal list (no reload)."""
+    goal_ref = get_user_goal_collection_ref(user_id)
+    batch = db.batch()
+    for goal_id in goal_ids:
+        batch.update(goal_ref.document(goal_id), {"completed": completed})
+    submit_write(user_id, 'goals', batch.commit, "Error updating goals")
+    for goal in st.session_state.goals:
+        if goal["id"] in goal_ids:
+            goal["completed"] = completed
+    st.success("Goal status updated!")
+
+def save_journal_analysis(user_id, entry, analysis):
+    """Stores the AI analysis on the journal entry so it is not regenerated on later renders."""
     try:
-        goal_ref = get_user_goal_collection_ref(user_id).document(goal_id)
-        goal_ref.update({"completed": completed})
-        # Reload goal data to update display immediately
-        st.session_state.goals = load_goals(user_id)
-        st.success("Goal status updated!")
+        get_user_journal_collection_ref(user_id).document(entry['id']).update({"analysis": analysis})
+        bump_data_revision(user_id, 'journal_entries')
+        entry['analysis'] = analysis
     except Exception as e:
-        st.error(f"Error updating goal: {e}")
+        st.error(f"Failed to save analysis: {e}")
+
+def delete_collections(col_refs):
+    """Deletes every document in the given collections with one BulkWriter (batched, parallel commits)."""
+    failures = []
+
+    def on_write_error(failure, _bulk_writer):
+        # Retry transient failures a few times, then record the document as not deleted
+        if failure.attempts < 5:
+            return True
+        failures.append(failure)
+        return False
+
+    # List all collections concurrently; list_documents() returns references only,
+    # so no document contents are read
+    with ThreadPoolExecutor(max_workers=len(col_refs)) as executor:
+        doc_ref_lists = list(executor.map(lambda col_ref: list(col_ref.list_documents()), col_refs))
+
+    # A single BulkWriter pipelines the deletes of all collections together
+    bulk_writer = db.bulk_writer()
+    bulk_writer.on_write_error(on_write_error)
+    for doc_refs in doc_ref_lists:
+        for doc_ref in doc_refs:
+            bulk_writer.delete(doc_ref)
+    bulk_writer.close()
+    if failures:
+        raise RuntimeError(f"{len(failures)} document(s) could not be deleted: {failures[0].message}")
 
 # --- 5. Gemini API Functions ---
-GEMINI_TEXT_MODEL = "gemini-2.5-flash"
+# The model can be overridden from the secrets (e.g. a lighter/faster Flash-Lite model)
+GEMINI_TEXT_MODEL = st.secrets.get("GEMINI_TEXT_MODEL", "gemini-2.5-flash")
 GEMINI_API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_TEXT_MODEL}:generateContent?key={GEMINI_API_KEY}"
+GEMINI_STREAM_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_TEXT_MODEL}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+GEMINI_TIMEOUT = (5, 30)  # (connect, read) seconds; for streams the read timeout is per chunk
+CHAT_CONTEXT_MESSAGES = 20  # prior chat messages sent to Gemini as context
+
+@st.cache_resource
+def get_http_session():
+    """Returns a pooled requests session shared by all Gemini calls (keeps TLS connections alive)."""
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    # Rate limits (429) and transient server errors are retried with a short exponential backoff.
+    # The backoff sleeps on the calling script thread, so the worst case is kept bounded:
+    # - read errors are never retried (read=0): the generation POST may already be running,
+    #   and waiting out another read timeout would only stall the UI further;
+    # - Retry-After is not honoured, since its value is unbounded;
+    # - at most 2 retries, backing off 1s then 2s.
+    retry = Retry(
+        total=2,
+        read=0,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=False,
+    )
+    session = requests.Session()
+    session.headers.update({'Content-Type': 'application/json'})
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry))
+    return session
+
+def get_api_error_message(error):
+    """Returns the Gemini error message from an HTTPError, falling back to the error itself."""
+    try:
+        return error.response.json().get('error', {}).get('message', str(error))
+    except ValueError:
+        return str(error)
+
+# Base system instruction shared by every mentor persona
+MENTOR_BASE_PROMPT = (
+    "You are 'Mind Mentor', a compassionate, insightful AI focused on mental wellness. "
+    "Your tone is gentle, encouraging, and non-judgemental. Offer supportive reflections, "
+    "evidence-based coping strategies, and practical exercises. "
+    "Keep responses concise, under 500 tokens."
+)
+
+# Persona-specific instruction appended to the base prompt (also the persona selector options)
+PERSONA_INSTRUCTIONS = {
+    "Default": "",
+    "Freud": " Focus your responses through a lens of psychodynamic principles (e.g., unconscious motives, early experiences).",
+    "Adler": " Focus on Individual Psychology (e.g., striving for superiority, social interest, lifestyle).",
+    "Jung": " Focus on analytical psychology (e.g., archetypes, collective unconscious, individuation).",
+    "Maslow": " Focus on humanistic principles and the Hierarchy of Needs (e.g., self-actualization, human potential).",
+    "Positive Psychology": " Focus on strengths, virtues, and optimal functioning (e.g., gratitude, flow, resilience).",
+    "CBT": " Focus on Cognitive Behavioral Therapy techniques (e.g., identifying thought patterns, challenging distortions, behavioral experiments).",
+}
+
+@st.cache_resource
+def get_persona_system_instructions():
+    """Returns the ready-made Gemini systemInstruction for every persona, built once per process."""
+    # The script module re-executes on every rerun, so this is cached rather than a module constant
+    return {
+        persona: {"parts": [{"text": MENTOR_BASE_PROMPT + instructions}]}
+        for persona, instructions in PERSONA_INSTRUCTIONS.items()
+    }
+
+def get_candidate_text(result):
+    """Returns the concatenated text parts of the first candidate in a Gemini response."""
+    candidate = result.get('candidates', [{}])[0]
+    return "".join(part.get('text', '') for part in candidate.get('content', {}).get('parts', []))
+
+# PERFORMANCE OPTIMIZATION: Analyses are cached by entry text, so re-running one (a double click,
+# or an entry whose saved analysis failed to persist) does not pay for a second API call.
+# Failed requests and empty replies raise and are therefore never cached.
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=500)
+def request_journal_analysis(content):
+    """Asks Gemini for the sentiment/themes analysis of a journal entry (cached per content)."""
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": f"Analyze this journal entry for sentiment, key themes, and offer a gentle, encouraging observation (max 100 words): {content}"}]}],
+        "generationConfig": {"maxOutputTokens": 100, "temperature": 0.7}
+    }
+    response = get_http_session().post(GEMINI_API_URL, json=payload, timeout=GEMINI_TIMEOUT)
+    response.raise_for_status()
+    result = response.json()
+    text = get_candidate_text(result).strip()
+    if not text:
+        # e.g. a MAX_TOKENS finish spent on thinking tokens, or a safety block
+        finish_reason = result.get('candidates', [{}])[0].get('finishReason', 'UNKNOWN')
+        raise ValueError(f"No analysis generated (finish reason: {finish_reason}).")
+    return text
+
+# Placeholder that older versions stored as if it were an analysis; treated as "no analysis"
+NO_ANALYSIS_PLACEHOLDER = "No analysis generated."
 
 def analyze_journal_entry(content):
-    """Analyzes a journal entry for sentiment and themes using Gemini."""
+    """Analyzes a journal entry for sentiment and themes using Gemini; returns None if there is no analysis."""
+    # Nothing to analyze: skip the API round trip entirely
+    if not content or not content.strip():
+        st.warning("This entry has no content to analyze.")
+        return None
     try:
-        payload = {
-            "contents": [{"role": "user", "parts": [{"text": f"Analyze this journal entry for sentiment, key themes, and offer a gentle, encouraging observation (max 100 words): {content}"}]}],
-            "generationConfig": {"maxOutputTokens": 100, "temperature": 0.7}
-        }
-        response = requests.post(GEMINI_API_URL, headers={'Content-Type': 'application/json'}, data=json.dumps(payload))
-        response.raise_for_status()
-        result = response.json()
-        text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-        return text.strip() if text else "No analysis generated."
+        return request_journal_analysis(content)
     except Exception as e:
         st.error(f"Error analyzing journal: {e}")
         return None
 
 # NOTE: The generate_personalized_journal_prompt function has been removed.
 
+def iter_sse_data(lines):
+    """Yields the parsed JSON payload of each `data:` line of a server-sent events stream.
+
+    Lines are raw bytes and decoded as UTF-8 here: the stream is served as text/event-stream
+    without a charset, so letting requests decode it would fall back to ISO-8859-1.
+    """
+    for line in lines:
+        if not line.startswith(b'data:'):
+            continue
+        yield json.loads(line[len(b'data:'):].decode('utf-8'))
+
 def generate_ai_text_reply(user_prompt):
-    """Handles the main chat generation with exponential backoff for retries."""
-    # Build chat history for context
-    chat_contents = [
-        {"role": "user" if msg["role"] == "user" else "model", "parts": [{"text": msg["content"]}]}
-        for msg in st.session_state.chat_history
-    ]
+    """Streams the main chat reply chunk by chunk (retries are handled by the HTTP session)."""
+    # Chat history for context (only the most recent messages, to keep the payload bounded);
+    # already converted to the Gemini format when it was loaded/saved
+    chat_contents = st.session_state.gemini_contents[-CHAT_CONTEXT_MESSAGES:]
+    # The cut can land on a model reply (or after a turn whose reply failed); Gemini expects the
+    # conversation to open with a user turn, so leading model messages are dropped
+    while chat_contents and chat_contents[0]["role"] != "user":
+        chat_contents.pop(0)
     chat_contents.append({"role": "user", "parts": [{"text": user_prompt}]})
     
-    # Define system prompt based on selected persona
-    persona = st.session_state.mentor_persona
-    
-    # Base system instruction
-    base_prompt = (
-        "You are 'Mind Mentor', a compassionate, insightful AI focused on mental wellness. "
-        "Your tone is gentle, encouraging, and non-judgemental. Offer supportive reflections, "
-        "evidence-based coping strategies, and practical exercises. "
-        "Keep responses concise, under 500 tokens."
-    )
-    
-    # Custom persona instructions
-    if persona == "Freud":
-        system_prompt = base_prompt + " Focus your responses through a lens of psychodynamic principles (e.g., unconscious motives, early experiences)."
-    elif persona == "Adler":
-        system_prompt = base_prompt + " Focus on Individual Psychology (e.g., striving for superiority, social interest, lifestyle)."
-    elif persona == "Jung":
-        system_prompt = base_prompt + " Focus on analytical psychology (e.g., archetypes, collective unconscious, individuation)."
-    elif persona == "Maslow":
-        system_prompt = base_prompt + " Focus on humanistic principles and the Hierarchy of Needs (e.g., self-actualization, human potential)."
-    elif persona == "Positive Psychology":
-        system_prompt = base_prompt + " Focus on strengths, virtues, and optimal functioning (e.g., gratitude, flow, resilience)."
-    elif persona == "CBT":
-        system_prompt = base_prompt + " Focus on Cognitive Behavioral Therapy techniques (e.g., identifying thought patterns, challenging distortions, behavioral experiments)."
-    else:
-        system_prompt = base_prompt
+    # System prompt for the selected persona (precomputed, no per-turn string building)
+    system_instructions = get_persona_system_instructions()
+    system_instruction = system_instructions.get(st.session_state.mentor_persona, system_instructions["Default"])
 
     payload = {
         "contents": chat_contents,
-        "systemInstruction": {"parts": [{"text": system_prompt}]},
+        "systemInstruction": system_instruction,
         "generationConfig": {"maxOutputTokens": 500, "temperature": 0.8}
     }
     
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(GEMINI_API_URL, headers={'Content-Type': 'application/json'}, data=json.dumps(payload))
-            response.raise_for_status()
-            result = response.json()
-            text = result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
-            
+    try:
+        # PERFORMANCE OPTIMIZATION: Stream the reply (server-sent events) so the first
+        # tokens are shown while the rest of the response is still being generated.
+        response = get_http_session().post(GEMINI_STREAM_URL, json=payload, timeout=GEMINI_TIMEOUT, stream=True)
+        response.raise_for_status()
+        has_text = False
+        finish_reason = 'UNKNOWN'
+        for chunk in iter_sse_data(response.iter_lines()):
+            finish_reason = chunk.get('candidates', [{}])[0].get('finishReason', finish_reason)
+            text = get_candidate_text(chunk)
             if text:
-                return text.strip()
-            
-            # Handle non-text responses (e.g., safety filters, max tokens)
-            finish_reason = result.get('candidates', [{}])[0].get('finishReason', 'UNKNOWN')
-            if finish_reason == 'SAFETY':
-                st.error("Response filtered due to safety settings. Please rephrase your query.")
-                return None
-            elif finish_reason == 'MAX_TOKENS':
-                st.warning("Response was cut short. Try a more specific question.")
-                return result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', 'Incomplete response.')
-            else:
-                st.error(f"Response empty or incomplete. Reason: {finish_reason}")
-                return None
-        
-        except requests.exceptions.HTTPError as e:
-            error_code = e.response.status_code if e.response else 0
-            if error_code == 429 and attempt < max_retries - 1:
-                # Apply exponential backoff
-                time.sleep(2 ** attempt)
-                continue
-            st.error(f"API Error: {e.response.json().get('error', {}).get('message', str(e))}")
-            return None
-        except Exception as e:
-            st.error(f"Unexpected error during API call: {e}")
-            return None
-    st.error("Failed after multiple retries to get a response.")
-    return None
+                has_text = True
+                yield text
+
+        if has_text:
+            return
+
+        # Handle non-text responses (e.g., safety filters, max tokens)
+        if finish_reason == 'SAFETY':
+            st.error("Response filtered due to safety settings. Please rephrase your query.")
+        elif finish_reason == 'MAX_TOKENS':
+            st.warning("Response was cut short. Try a more specific question.")
+            yield 'Incomplete response.'
+        else:
+            st.error(f"Response empty or incomplete. Reason: {finish_reason}")
+
+    except requests.exceptions.RetryError:
+        st.error("Failed after multiple retries to get a response.")
+    except requests.exceptions.HTTPError as e:
+        st.error(f"API Error: {get_api_error_message(e)}")
+    except Exception as e:
+        st.error(f"Unexpected error during API call: {e}")
 
 # --- 6. Utility Functions ---
-def generate_export_content():
-    """Generates a text string containing all user data for download."""
-    export_text = f"--- Mind Universe Data Export for User: {st.session_state.current_user_email} ---\n"
-    export_text += f"Export Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-    export_text += "============== JOURNAL ENTRIES ==============\n"
-    if st.session_state.journal_entries:
-        for entry in st.session_state.journal_entries:
-            export_text += f"Date: {entry.get('date', 'N/A')}\n"
-            export_text += f"Title: {entry.get('title', 'No Title')}\n"
-            export_text += f"Mood: {entry.get('mood', 'N/A')}\n"
-            export_text += f"Content:\n{entry.get('content', 'No content')}\n"
-            export_text += "-" * 20 + "\n"
+def get_session_data_key(user_id, collection):
+    """Returns a cheap cache key for a session-state list: its revision, length and both end timestamps.
+
+    Built in O(1), so cached helpers can take the list itself as an unhashed underscore argument.
+    """
+    items = st.session_state[collection]
+    if not items:
+        return (get_data_revision(user_id, collection), 0, None, None)
+    return (get_data_revision(user_id, collection), len(items), items[0].get('timestamp'), items[-1].get('timestamp'))
+
+def build_export_body(journal_entries, chat_history, goals):
+    """Builds the journal/chat/goal sections of the export."""
+    parts = ["============== JOURNAL ENTRIES ==============\n"]
+    if journal_entries:
+        for entry in journal_entries:
+            parts.append(
+                f"Date: {entry.get('date', 'N/A')}\n"
+                f"Title: {entry.get('title', 'No Title')}\n"
+                f"Mood: {entry.get('mood', 'N/A')}\n"
+                f"Content:\n{entry.get('content', 'No content')}\n"
+                + "-" * 20 + "\n"
+            )
     else:
-        export_text += "No journal entries found.\n\n"
-    export_text += "\n============== CHAT HISTORY ==============\n"
-    if st.session_state.chat_history:
-        for message in sorted(st.session_state.chat_history, key=lambda x: x.get('timestamp', 0)):
+        parts.append("No journal entries found.\n\n")
+    parts.append("\n============== CHAT HISTORY ==============\n")
+    if chat_history:
+        # Chat history is read in chronological order (server-side order_by), no sort needed
+        for message in chat_history:
             dt_object = datetime.fromtimestamp(message.get('timestamp', 0))
             time_str = dt_object.strftime('%Y-%m-%d %H:%M:%S')
             role = message.get('role', 'unknown').upper()
             content = message.get('content', '')
-            export_text += f"[{time_str}] {role}: {content}\n"
+            parts.append(f"[{time_str}] {role}: {content}\n")
     else:
-        export_text += "No chat messages found.\n\n"
-    export_text += "\n============== GOALS ==============\n"
-    if st.session_state.goals:
-        for goal in st.session_state.goals:
+        parts.append("No chat messages found.\n\n")
+    parts.append("\n============== GOALS ==============\n")
+    if goals:
+        for goal in goals:
             status = "Completed" if goal["completed"] else "Pending"
-            export_text += f"Goal: {goal.get('text', 'N/A')} (Due: {goal.get('deadline', 'None')}, Status: {status})\n"
+            parts.append(f"Goal: {goal.get('text', 'N/A')} (Due: {goal.get('deadline', 'None')}, Status: {status})\n")
     else:
-        export_text += "No goals found.\n"
-    return export_text.encode('utf-8')
+        parts.append("No goals found.\n")
+    return "".join(parts)
+
+def generate_export_content(user_id):
+    """Generates the download file containing all of the user's data, read in full from Firestore."""
+    data = fetch_export_data(user_id)
+    body = build_export_body(data['journal_entries'], data['chat_history'], data['goals'])
+    header = (
+        f"--- Mind Universe Data Export for User: {user_id} ---\n"
+        f"Export Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    )
+    return (header + body).encode('utf-8')
+
+
+@st.cache_data(show_spinner=False, max_entries=100)
+def build_mood_chart_data(data_key, _journal_entries):
+    """Builds the daily mood trend DataFrame from the journal entries (cached per data_key).
+
+    The underscore-prefixed list is not hashed by Streamlit; data_key identifies its content.
+    """
+    # pandas is only needed for this chart, so it is not imported until there is one to draw;
+    # the login page and the chat view start without paying for the import
+    import pandas as pd
+
+    # journal_entries is kept newest first (server-side order_by, new entries inserted on top,
+    # older pages appended), so reading it backwards is chronological without a sort
+    chronological_entries = _journal_entries[::-1]
+    # Columnar build: one list per column goes straight into typed arrays, with no per-row
+    # tuples/dicts and no intermediate frame; the scores were computed when the entries were
+    # written (or loaded), and the timestamps are converted in a single to_datetime call
+    timestamps = [entry.get('timestamp', 0) for entry in chronological_entries]
+    scores = [entry.get('mood_score', DEFAULT_MOOD_SCORE) for entry in chronological_entries]
+    # Server-local wall-clock times (like datetime.fromtimestamp), as naive datetimes for the chart axis
+    dates = pd.to_datetime(timestamps, unit="s", utc=True).tz_convert(datetime.now().astimezone().tzinfo).tz_localize(None)
+    mood_series = pd.Series(scores, index=dates, name="Mood Score", dtype="int8")
+    # One point per day (the day's average mood) keeps the chart payload at the number of days
+    # journaled rather than the number of entries; days without entries are left out
+    return mood_series.resample("D").mean().dropna().to_frame()
 
 
 # --- 7. UI Rendering Functions (Updated for Lazy Loading and Serene Theme) ---
+CHAT_CONTAINER_HEIGHT = 500  # pixels; the chat history scrolls inside this box
+CHAT_RENDER_WINDOW = 30  # most recent chat messages rendered by default
+JOURNAL_RENDER_WINDOW = 20  # journal entries rendered at first, and added per "Show older entries"
+VIEW_OPTIONS = ("✍️ Wellness Journal", "💬 AI Mentor")
+# Updated avatars for a serene feel
+ROLE_AVATARS = {"user": "👤", "assistant": "💡"}
+MOOD_OPTIONS = ("Happy", "Calm", "Excited", "Stressed", "Anxious", "Sad")
 
 def display_auth_page():
     """Displays the login and sign up forms."""
@@ -446,14 +821,200 @@ def display_auth_page():
             elif signup_submitted:
                 st.warning("Please enter a valid email and password (min 6 characters).")
 
+# PERFORMANCE OPTIMIZATION: Each entry body is its own fragment, so "AI Analyze Entry" only
+# reruns that entry instead of the whole journal tab (form, history and chart).
+@st.fragment
+def display_journal_entry(entry):
+    """Renders one journal entry's content and its AI analysis (or the button to request one)."""
+    st.markdown(entry.get('content'))
+    
+    # Analyses are stored with the entry, so a previous one is shown without a new API call
+    if entry.get('analysis') and entry['analysis'] != NO_ANALYSIS_PLACEHOLDER:
+        st.info(f"**AI Mentor Observation**: {entry['analysis']}")
+    elif st.button("AI Analyze Entry", key=f"analyze_{entry.get('timestamp')}"):
+        with st.spinner("Analyzing entry..."):
+            analysis = analyze_journal_entry(entry.get('content'))
+            # Only real analysis text is stored; a failed or empty one leaves the button available
+            if analysis:
+                save_journal_analysis(st.session_state.current_user_email, entry, analysis)
+                st.success("Analysis Complete")
+                st.info(f"**AI Mentor Observation**: {analysis}")
+
+# PERFORMANCE OPTIMIZATION: The journal tab is a fragment, so saving an entry, analyzing one or
+# loading older pages only reruns this tab instead of the whole app.
+@st.fragment
+def display_journal_tab():
+    """Renders the Wellness Journal tab: entry form, history and mood trends."""
+    # Fragment reruns skip display_main_app; a failed background write needs a full rerun
+    # so its error is shown and the collection is reloaded
+    if collect_failed_writes():
+        st.rerun()
+
+    st.header("Reflect & Record")
+    st.caption("Your private space for logging thoughts, feelings, and progress.")
+    
+    # Journal entries are loaded together with the other collections at the top of display_main_app
+    
+    # NOTE: Removed the "Generate Personalized Prompt" button and logic.
+    
+    # --- Journal Form ---
+    with st.form("journal_form", clear_on_submit=True):
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            entry_date = st.date_input("Date", datetime.today())
+        with col2:
+            entry_title = st.text_input("Title (Optional)", placeholder="A brief summary of your entry")
+        
+        # Text area now uses a standard placeholder value
+        entry_content = st.text_area(
+            "What's on your mind today?", 
+            value="", 
+            height=200, 
+            placeholder="Write freely..."
+        )
+        
+        mood = st.selectbox("How are you feeling?", MOOD_OPTIONS)
+        
+        submitted = st.form_submit_button("Save Entry", type="primary")
+        if submitted and entry_content.strip():
+            # The entry is added to the local list before the history below is rendered, no rerun needed
+            # (unless a prepared export in the sidebar has to be withdrawn)
+            export_was_prepared = st.session_state.export_data is not None
+            save_journal_entry(entry_date.strftime('%Y-%m-%d'), entry_title, entry_content, mood)
+            rerun_if_export_dropped(export_was_prepared)
+        elif submitted:
+            st.warning("Please write some content before saving.")
+
+    st.divider()
+    
+    # --- Journal History ---
+    st.subheader("Journal History")
+    if st.session_state.journal_entries:
+        # PERFORMANCE OPTIMIZATION: Only the newest entries get expanders/buttons; older ones are
+        # rendered on request instead of instantiating widgets for the whole history on every rerun
+        visible_count = max(st.session_state.journal_visible, JOURNAL_RENDER_WINDOW)
+        for entry in st.session_state.journal_entries[:visible_count]:
+            with st.expander(f"**{entry.get('date')}** — {entry.get('title', 'Untitled Entry')} — Mood: {entry.get('mood', 'N/A')}"):
+                display_journal_entry(entry)
+
+        has_hidden = visible_count < len(st.session_state.journal_entries)
+        if (has_hidden or st.session_state.journal_has_more) and st.button("Show older entries"):
+            st.session_state.journal_visible = visible_count + JOURNAL_RENDER_WINDOW
+            # Only the newest page is read up front; the next page is fetched once the loaded ones are all shown
+            if st.session_state.journal_visible > len(st.session_state.journal_entries) and st.session_state.journal_has_more:
+                with st.spinner("Loading older entries..."):
+                    oldest_timestamp = st.session_state.journal_entries[-1].get('timestamp', 0)
+                    older_entries = load_journal_entries(st.session_state.current_user_email, before=oldest_timestamp)
+                    st.session_state.journal_entries.extend(older_entries)
+                    st.session_state.journal_has_more = len(older_entries) == JOURNAL_LOAD_LIMIT
+            st.rerun(scope="fragment")
+    else:
+        st.info("No journal entries found. Start writing above!")
+        
+    # --- Mood Trends Chart ---
+    st.subheader("Mood Trends")
+    if st.session_state.journal_entries:
+        # PERFORMANCE OPTIMIZATION: The chart data is cached, so reruns that did not add or
+        # change an entry (tab switches, goal updates, analyze buttons) skip rebuilding the DataFrame;
+        # the cache key is O(1) instead of a hash over every entry.
+        data_key = (st.session_state.current_user_email,) + get_session_data_key(st.session_state.current_user_email, 'journal_entries')
+        df = build_mood_chart_data(data_key, st.session_state.journal_entries)
+
+        if not df.empty:
+            # Chart color changed to a calming blue/green color for serenity
+            st.line_chart(df, y="Mood Score", color="#6495ED") 
+            
+            # Show key for scores
+            st.markdown("Mood Score Key: 5=Happy, 3=Calm, 0=Sad")
+            # The chart only covers the loaded journal pages; say so instead of implying a full history
+            if st.session_state.journal_has_more:
+                st.caption(
+                    f"Based on your {len(st.session_state.journal_entries)} most recent entries. "
+                    "Use \"Show older entries\" above to include older ones."
+                )
+        else:
+            st.info("Not enough data points to display mood trends.")
+    else:
+        st.info("No mood data to display yet.")
+
+
+# PERFORMANCE OPTIMIZATION: The chat is a fragment, so sending a message or changing the persona
+# only reruns this function instead of the whole app (sidebar, goals, data loading).
+@st.fragment
+def display_mentor_chat():
+    """Renders the persona selector, the chat history and the chat input of the AI Mentor tab."""
+    # Fragment reruns skip display_main_app; a failed background write needs a full rerun
+    # so its error is shown and the collection is reloaded
+    if collect_failed_writes():
+        st.rerun()
+
+    # Mentor Persona Selector
+    st.selectbox(
+        "Choose Mentor Persona (This updates the AI's guidance style)", 
+        list(PERSONA_INSTRUCTIONS), 
+        key="mentor_persona",
+        help="Selecting a persona will influence the advice given by the AI Mentor."
+    )
+    
+    st.divider()
+    
+    # Display chat history (already loaded at the start) in a fixed-height, scrollable
+    # container so long conversations don't reflow the whole page on every rerun
+    # PERFORMANCE OPTIMIZATION: Only the most recent messages are rendered unless the user asks for more
+    visible_history = st.session_state.chat_history
+    hidden_count = len(visible_history) - CHAT_RENDER_WINDOW
+    if hidden_count > 0 and not st.toggle(f"Show {hidden_count} earlier messages", key="show_earlier_chat"):
+        visible_history = visible_history[-CHAT_RENDER_WINDOW:]
+    chat_container = st.container(height=CHAT_CONTAINER_HEIGHT)
+    with chat_container:
+        for message in visible_history:
+            role = "user" if message["role"] == "user" else "assistant"
+            with st.chat_message(role, avatar=ROLE_AVATARS[role]):
+                st.markdown(message["content"])
+    
+    # Chat input and response logic
+    if prompt := st.chat_input(f"Type your message to Mind Mentor ({st.session_state.mentor_persona} mode)..."):
+        user_message = new_chat_message("user", prompt)
+        ai_response_text = None
+        export_was_prepared = st.session_state.export_data is not None
+        try:
+            with chat_container:
+                # 1. Display user message
+                with st.chat_message("user", avatar=ROLE_AVATARS["user"]):
+                    st.markdown(prompt)
+                
+                # 2. Generate AI response, rendering it as it streams in
+                with st.chat_message("assistant", avatar=ROLE_AVATARS["assistant"]):
+                    ai_response_text = st.write_stream(generate_ai_text_reply(prompt))
+        finally:
+            # 3. Save the user message and the AI response together in one batch. This runs even
+            # when an interaction stops or reruns the script mid-stream, so the prompt is never
+            # lost (only the unfinished reply is). Both are already on screen, so no st.rerun()
+            # is needed; the next natural rerun renders them from chat_history.
+            chat_turn = [user_message]
+            if ai_response_text:
+                chat_turn.append(new_chat_message("model", ai_response_text))
+            save_chat_messages(chat_turn)
+        rerun_if_export_dropped(export_was_prepared)
+
+
 def display_main_app():
     """Renders the main application UI after authentication."""
     
-    # PERFORMANCE OPTIMIZATION: Load only CHAT history on initial access/login.
-    if not st.session_state.chat_loaded:
-        with st.spinner("Loading core chat history (fast initial load)..."):
-            st.session_state.chat_history = load_chat_history(st.session_state.current_user_email)
-            st.session_state.chat_loaded = True
+    report_write_errors()
+
+    # PERFORMANCE OPTIMIZATION: Load all three collections in parallel on initial access/login,
+    # so the reads cost about one round trip instead of three.
+    pending = [name for name, flag in LOADED_FLAGS.items() if not st.session_state[flag]]
+    if pending:
+        with st.spinner("Loading your data..."):
+            for name, items in load_user_data(st.session_state.current_user_email, pending).items():
+                st.session_state[name] = items
+                st.session_state[LOADED_FLAGS[name]] = True
+            if 'chat_history' in pending:
+                st.session_state.gemini_contents = [to_gemini_content(message) for message in st.session_state.chat_history]
+            if 'journal_entries' in pending:
+                st.session_state.journal_has_more = len(st.session_state.journal_entries) == JOURNAL_LOAD_LIMIT
 
     st.title("🧘‍♀️ Mind Universe")
     st.caption(f"Welcome, {st.session_state.current_user_email} (ID: {st.session_state.current_user_email})")
@@ -466,12 +1027,24 @@ def display_main_app():
         st.divider()
         
         st.subheader("Data Management")
-        st.download_button(
-            label="Download History (TXT)",
-            data=generate_export_content(),
-            file_name=f"mind_universe_export_{datetime.now().strftime('%Y%m%d')}.txt",
-            mime="text/plain"
-        )
+        # PERFORMANCE OPTIMIZATION: The export is only built once the user asks for it (it reads
+        # the full collections), instead of on every rerun just to fill the download button.
+        if st.session_state.export_data is None:
+            if st.button("Prepare Download"):
+                with st.spinner("Preparing your export..."):
+                    try:
+                        st.session_state.export_data = generate_export_content(st.session_state.current_user_email)
+                    except Exception as e:
+                        st.error(f"Failed to prepare export: {e}")
+                if st.session_state.export_data is not None:
+                    st.rerun()
+        else:
+            st.download_button(
+                label="Download History (TXT)",
+                data=st.session_state.export_data,
+                file_name=f"mind_universe_export_{datetime.now().strftime('%Y%m%d')}.txt",
+                mime="text/plain"
+            )
         
         # --- Clear History ---
         st.subheader("⚠️ Clear History")
@@ -486,18 +1059,23 @@ def display_main_app():
                     with st.spinner("Deleting data..."):
                         try:
                             # Delete collections
-                            for doc in get_user_chat_collection_ref(st.session_state.current_user_email).stream():
-                                doc.reference.delete()
-                            for doc in get_user_journal_collection_ref(st.session_state.current_user_email).stream():
-                                doc.reference.delete()
-                            for doc in get_user_goal_collection_ref(st.session_state.current_user_email).stream():
-                                doc.reference.delete()
+                            delete_collections([
+                                get_user_chat_collection_ref(st.session_state.current_user_email),
+                                get_user_journal_collection_ref(st.session_state.current_user_email),
+                                get_user_goal_collection_ref(st.session_state.current_user_email),
+                            ])
+                            for collection in ('chat_history', 'journal_entries', 'goals'):
+                                bump_data_revision(st.session_state.current_user_email, collection)
                             
                             # Reset all loading states
                             st.session_state.chat_loaded = False
                             st.session_state.journal_loaded = False
                             st.session_state.goals_loaded = False
                             st.session_state.confirm_delete = False
+                            # Pagination and export state belonged to the deleted data
+                            st.session_state.journal_visible = 0
+                            st.session_state.journal_has_more = False
+                            st.session_state.export_data = None
                             st.success("All data deleted. Reloading...")
                             st.rerun()
                         except Exception as e:
@@ -510,13 +1088,7 @@ def display_main_app():
         
         # --- Goal Setting ---
         st.subheader("Goal Setting")
-        # PERFORMANCE OPTIMIZATION: Load goals only when rendering the sidebar section
-        if not st.session_state.goals_loaded:
-            with st.spinner("Loading goals..."):
-                st.session_state.goals = load_goals(st.session_state.current_user_email)
-                st.session_state.goals_loaded = True
-                # If goals loaded, we rerun to render them immediately
-                st.rerun() 
+        # Goals are loaded together with the other collections at the top of display_main_app
         
         with st.form("goal_form", clear_on_submit=True):
             goal_text = st.text_input("Set a new goal")
@@ -531,26 +1103,35 @@ def display_main_app():
         st.subheader("Your Goals")
         
         if st.session_state.goals:
-            for goal in st.session_state.goals:
-                col1, col2 = st.columns([3, 1])
-                is_completed = goal["completed"]
-                text_style = "text-decoration: line-through; color: #888;" if is_completed else ""
-
-                with col1:
-                    st.markdown(f'<p style="{text_style}">**{goal["text"]}** (Due: {goal.get("deadline", "None")})</p>', unsafe_allow_html=True)
-                with col2:
-                    # Use a unique key for the checkbox tied to goal ID
-                    completed = st.checkbox("Done", value=is_completed, key=f"goal_check_{goal['id']}")
-                    if completed != is_completed:
-                        update_goal_status(st.session_state.current_user_email, goal["id"], completed)
-                        st.rerun() # Rerun to re-render the list with updated styling
+            # PERFORMANCE OPTIMIZATION: Only pending goals get widgets, inside a form so ticking
+            # them does not rerun the script; completed goals are a single read-only markdown block.
+            pending_goals = [goal for goal in st.session_state.goals if not goal["completed"]]
+            completed_goals = [goal for goal in st.session_state.goals if goal["completed"]]
+            if pending_goals:
+                with st.form("goal_updates"):
+                    done_ids = [
+                        goal["id"] for goal in pending_goals
+                        # Use a unique key for the checkbox tied to goal ID
+                        if st.checkbox(f'**{goal["text"]}** (Due: {goal.get("deadline") or "None"})', key=f"goal_check_{goal['id']}")
+                    ]
+                    if st.form_submit_button("Mark Selected as Done"):
+                        if done_ids:
+                            update_goals_status(st.session_state.current_user_email, done_ids, True)
+                            st.rerun() # Rerun to move the goals to the completed list
+                        else:
+                            st.warning("Select at least one goal.")
+            if completed_goals:
+                st.markdown("".join(
+                    f'<p style="text-decoration: line-through; color: #888;"><b>{html.escape(goal["text"])}</b> '
+                    f'(Due: {html.escape(goal.get("deadline") or "None")})</p>'
+                    for goal in completed_goals
+                ), unsafe_allow_html=True)
         else:
             st.info("No goals set yet.")
 
 
     # --- Navigation ---
-    view_options = ["✍️ Wellness Journal", "💬 AI Mentor"]
-    selected_view = st.radio("Navigation", view_options, index=view_options.index(st.session_state.current_tab), horizontal=True, label_visibility="hidden")
+    selected_view = st.radio("Navigation", VIEW_OPTIONS, index=VIEW_OPTIONS.index(st.session_state.current_tab), horizontal=True, label_visibility="hidden")
     if selected_view != st.session_state.current_tab:
         st.session_state.current_tab = selected_view
         st.rerun()
@@ -558,141 +1139,14 @@ def display_main_app():
 
     # --- Wellness Journal Tab ---
     if st.session_state.current_tab == "✍️ Wellness Journal":
-        st.header("Reflect & Record")
-        st.caption("Your private space for logging thoughts, feelings, and progress.")
-        
-        # PERFORMANCE OPTIMIZATION: Load journal data only when the tab is accessed
-        if not st.session_state.journal_loaded:
-            with st.spinner("Loading your journal entries..."):
-                st.session_state.journal_entries = load_journal_entries(st.session_state.current_user_email)
-                st.session_state.journal_loaded = True
-                st.rerun() # Rerun to display loaded entries immediately
-        
-        # NOTE: Removed the "Generate Personalized Prompt" button and logic.
-        
-        # --- Journal Form ---
-        with st.form("journal_form", clear_on_submit=True):
-            col1, col2 = st.columns([1, 3])
-            with col1:
-                entry_date = st.date_input("Date", datetime.today())
-            with col2:
-                entry_title = st.text_input("Title (Optional)", placeholder="A brief summary of your entry")
-            
-            # Text area now uses a standard placeholder value
-            entry_content = st.text_area(
-                "What's on your mind today?", 
-                value="", 
-                height=200, 
-                placeholder="Write freely..."
-            )
-            
-            mood = st.selectbox("How are you feeling?", ["Happy", "Calm", "Excited", "Stressed", "Anxious", "Sad"])
-            
-            submitted = st.form_submit_button("Save Entry", type="primary")
-            if submitted and entry_content:
-                save_journal_entry(entry_date.strftime('%Y-%m-%d'), entry_title, entry_content, mood)
-                st.rerun()
-            elif submitted:
-                st.warning("Please write some content before saving.")
-
-        st.divider()
-        
-        # --- Journal History ---
-        st.subheader("Journal History")
-        if st.session_state.journal_entries:
-            for entry in st.session_state.journal_entries:
-                with st.expander(f"**{entry.get('date')}** — {entry.get('title', 'Untitled Entry')} — Mood: {entry.get('mood', 'N/A')}"):
-                    st.markdown(entry.get('content'))
-                    
-                    if st.button("AI Analyze Entry", key=f"analyze_{entry.get('timestamp')}"):
-                        with st.spinner("Analyzing entry..."):
-                            analysis = analyze_journal_entry(entry.get('content'))
-                            if analysis:
-                                st.success("Analysis Complete")
-                                st.info(f"**AI Mentor Observation**: {analysis}")
-        else:
-            st.info("No journal entries found. Start writing above!")
-            
-        # --- Mood Trends Chart ---
-        st.subheader("Mood Trends")
-        if st.session_state.journal_entries:
-            # Mood mapping for chart scoring (higher is generally better)
-            mood_scores = {"Happy": 5, "Excited": 4, "Calm": 3, "Anxious": 2, "Stressed": 1, "Sad": 0}
-            
-            # Sort entries chronologically (oldest first for trend line)
-            chronological_entries = sorted(st.session_state.journal_entries, key=lambda x: x.get('timestamp', 0))
-
-            chart_data_list = []
-            for entry in chronological_entries:
-                mood_label = entry.get("mood", "Calm")
-                score = mood_scores.get(mood_label, 3)
-                
-                # Use a combined key (date + timestamp fraction) for potentially multiple entries on the same day
-                entry_dt = datetime.fromtimestamp(entry.get('timestamp', 0))
-                
-                chart_data_list.append({
-                    "Date": entry_dt,
-                    "Mood Score": score,
-                    "Mood Label": mood_label
-                })
-
-            if chart_data_list:
-                df = pd.DataFrame(chart_data_list)
-                # Set date as index for chronological charting
-                df = df.set_index("Date") 
-                
-                # Chart color changed to a calming blue/green color for serenity
-                st.line_chart(df, y="Mood Score", color="#6495ED") 
-                
-                # Show key for scores
-                st.markdown("Mood Score Key: 5=Happy, 3=Calm, 0=Sad")
-            else:
-                st.info("Not enough data points to display mood trends.")
-        else:
-            st.info("No mood data to display yet.")
+        display_journal_tab()
 
     # --- AI Mentor Tab ---
     elif st.session_state.current_tab == "💬 AI Mentor":
         st.header("Ask Your Mentor")
         st.caption("Chat with your supportive AI mentor for insights, coping strategies, and reflections.")
         
-        # Mentor Persona Selector
-        st.selectbox(
-            "Choose Mentor Persona (This updates the AI's guidance style)", 
-            ["Default", "Freud", "Adler", "Jung", "Maslow", "Positive Psychology", "CBT"], 
-            key="mentor_persona",
-            help="Selecting a persona will influence the advice given by the AI Mentor."
-        )
-        
-        st.divider()
-        
-        # Display chat history (already loaded at the start)
-        for message in st.session_state.chat_history:
-            role = "user" if message["role"] == "user" else "assistant"
-            # Updated avatars for a serene feel
-            avatar = "👤" if role == "user" else "💡"
-            with st.chat_message(role, avatar=avatar):
-                st.markdown(message["content"])
-        
-        # Chat input and response logic
-        if prompt := st.chat_input(f"Type your message to Mind Mentor ({st.session_state.mentor_persona} mode)..."):
-            # 1. Display user message
-            with st.chat_message("user", avatar="👤"):
-                st.markdown(prompt)
-            
-            # 2. Save user message
-            save_chat_message("user", prompt)
-            
-            # 3. Generate AI response
-            with st.chat_message("assistant", avatar="💡"):
-                with st.spinner(f"Mind Mentor ({st.session_state.mentor_persona}) is reflecting..."):
-                    ai_response_text = generate_ai_text_reply(prompt)
-                    
-                if ai_response_text:
-                    st.markdown(ai_response_text)
-                    # 4. Save AI response and Rerun
-                    save_chat_message("model", ai_response_text)
-                    st.rerun()
+        display_mentor_chat()
 
 
 # --- Main Application Logic ---
@@ -0,0 +1,43 @@
+"""Tests for the Gemini server-sent events parsing in app.py.
+
+app.py reads Streamlit secrets and connects to Firebase at import time, so the
+helper under test is compiled on its own from the module source.
+"""
+import ast
+import json
+from pathlib import Path
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+
+def load_app_function(name):
+    """Returns a top-level function from app.py without executing the rest of the module."""
+    tree = ast.parse(APP_PATH.read_text(encoding="utf-8"))
+    node = next(n for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == name)
+    namespace = {"json": json}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), str(APP_PATH), "exec"), namespace)
+    return namespace[name]
+
+
+iter_sse_data = load_app_function("iter_sse_data")
+
+
+def sse_line(payload):
+    """Encodes a payload the way Gemini sends it: one UTF-8 `data:` line, non-ASCII left as is."""
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def test_multibyte_utf8_text_is_decoded_intact():
+    text = "Hello — here’s a thought \U0001F33F, café"
+    chunk = {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+    chunks = list(iter_sse_data([sse_line(chunk)]))
+
+    assert chunks == [chunk]
+    assert chunks[0]["candidates"][0]["content"]["parts"][0]["text"] == text
+
+
+def test_non_data_lines_are_skipped():
+    lines = [b"", b": keep-alive", b"event: message", sse_line({"n": 1}), b"", sse_line({"n": 2})]
+
+    assert list(iter_sse_data(lines)) == [{"n": 1}, {"n": 2}]